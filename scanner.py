@@ -4,6 +4,9 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from zoneinfo import ZoneInfo
+import json
 import os
 import time
 from bs4 import BeautifulSoup
@@ -28,6 +31,15 @@ class MultiArchetypeTradingScanner:
             'Sec-Fetch-Site': 'none'
         })
         
+        # Market context cache (reused by intraday runs of the same session on the same host)
+        self.market_cache_file = os.environ.get('MARKET_CACHE_FILE', '.market_context_cache.json')
+        try:
+            self.market_cache_ttl = max(0, int(os.environ.get('MARKET_CACHE_TTL', '300')))  # seconds
+        except ValueError:
+            print("⚠️ Invalid MARKET_CACHE_TTL, using default of 300 seconds")
+            self.market_cache_ttl = 300
+        self._market_cache = None
+        
         # Three foundational trading archetypes
         self.strategies = {
             'trend_following': {
@@ -277,7 +289,173 @@ class MultiArchetypeTradingScanner:
             {'name': 'HDFCBANK', 'close': 1598.25, 'per_chg': -0.23, 'volume': 18900000},
             {'name': 'ICICIBANK', 'close': 1245.80, 'per_chg': 1.67, 'volume': 22100000}
         ]
-    
+
+    def _get_unavailable_market_data(self, reason):
+        """Return clearly labelled placeholder when live market context is unavailable"""
+        return {
+            'available': False,
+            'nifty_level': 'Unavailable',
+            'nifty_change': 'Unavailable',
+            'advances': None,
+            'declines': None,
+            'breadth': 'Unavailable',
+            'vix': 'Unavailable',
+            'market_trend': f'Live market data unavailable ({reason})',
+            'fetched_at': None
+        }
+
+    def _session_date(self):
+        """Current trading session date in IST"""
+        return datetime.now(ZoneInfo('Asia/Kolkata')).strftime('%Y-%m-%d')
+
+    def _load_cached_market_data(self):
+        """Return cached market context if it belongs to this session and is within TTL"""
+        cached = self._market_cache
+
+        if cached is None:
+            try:
+                with open(self.market_cache_file, 'r', encoding='utf-8') as f:
+                    cached = json.load(f)
+            except (OSError, ValueError):
+                return None
+
+        # Ignore anything that is not a well-formed entry written by _save_market_cache
+        if not isinstance(cached, dict) or cached.get('session') != self._session_date():
+            return None
+
+        # Only successful fetches are cached, so every display field must be a string
+        data = cached.get('data')
+        string_keys = ('nifty_level', 'nifty_change', 'breadth', 'vix', 'market_trend', 'fetched_at')
+        if not isinstance(data, dict) or data.get('available') is not True:
+            return None
+        if not all(isinstance(data.get(key), str) for key in string_keys):
+            return None
+
+        timestamp = cached.get('timestamp')
+        if not isinstance(timestamp, (int, float)):
+            return None
+
+        # Future timestamps (clock skew, copied files) are treated as stale
+        age = time.time() - timestamp
+        if age < 0 or age > self.market_cache_ttl:
+            return None
+
+        self._market_cache = cached
+        return data
+
+    def _save_market_cache(self, market_data):
+        """Persist market context so later intraday runs of the session reuse it"""
+        self._market_cache = {
+            'session': self._session_date(),
+            'timestamp': time.time(),
+            'data': market_data
+        }
+        try:
+            with open(self.market_cache_file, 'w', encoding='utf-8') as f:
+                json.dump(self._market_cache, f)
+        except OSError as e:
+            print(f"⚠️ Could not write market cache: {str(e)}")
+
+    def _describe_market_trend(self, change, advances, declines):
+        """Build a short trend summary from index change and breadth"""
+        if change > 0.5:
+            direction = 'Positive bias'
+        elif change < -0.5:
+            direction = 'Negative bias'
+        else:
+            direction = 'Flat, range-bound trade'
+
+        if advances is None or declines is None:
+            return direction
+
+        # Breadth covers the 50 index constituents only, not the whole market
+        if advances > declines * 1.5:
+            breadth = 'Nifty 50 advancers leading'
+        elif declines > advances * 1.5:
+            breadth = 'Nifty 50 decliners leading'
+        else:
+            breadth = 'mixed Nifty 50 breadth'
+
+        return f'{direction} with {breadth}'
+
+    def fetch_market_context(self):
+        """Fetch Nifty level, breadth and VIX from NSE, cached per trading session"""
+        try:
+            cached = self._load_cached_market_data()
+        except (AttributeError, TypeError, ValueError) as e:
+            print(f"⚠️ Ignoring unreadable market cache: {str(e)}")
+            cached = None
+        if cached:
+            print("♻️ Using cached market context for this session")
+            return cached
+
+        # Separate session so this can run alongside Chartink queries
+        session = requests.Session()
+        session.headers.update({
+            'User-Agent': self.session.headers['User-Agent'],
+            'Accept': 'application/json, text/plain, */*',
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Referer': 'https://www.nseindia.com/'
+        })
+
+        try:
+            print("🏛️ Fetching live market context from NSE...")
+
+            # NSE requires cookies from the home page before serving the API
+            session.get('https://www.nseindia.com/', timeout=10)
+            response = session.get('https://www.nseindia.com/api/allIndices', timeout=10)
+            response.raise_for_status()
+
+            payload = response.json()
+            if not isinstance(payload, dict) or not isinstance(payload.get('data'), list):
+                print("❌ Unexpected NSE response shape")
+                return self._get_unavailable_market_data('unexpected response')
+
+            indices = {item.get('index'): item for item in payload['data'] if isinstance(item, dict)}
+            nifty = indices.get('NIFTY 50')
+            vix = indices.get('INDIA VIX')
+
+            if not nifty or not vix:
+                print("❌ Nifty 50 or India VIX missing from NSE response")
+                return self._get_unavailable_market_data('incomplete response')
+
+            change = float(nifty['percentChange'])
+
+            # Breadth is optional; never substitute a made-up count
+            if nifty.get('advances') is not None and nifty.get('declines') is not None:
+                advances = int(nifty['advances'])
+                declines = int(nifty['declines'])
+                breadth = f'{advances} / {declines}'
+            else:
+                print("⚠️ Nifty 50 advance/decline data missing from NSE response")
+                advances = declines = None
+                breadth = 'Unavailable'
+
+            market_data = {
+                'available': True,
+                'nifty_level': f"{float(nifty['last']):,.2f}",
+                'nifty_change': f'{change:+.2f}%',
+                'advances': advances,
+                'declines': declines,
+                'breadth': breadth,
+                'vix': f"{float(vix['last']):.2f}",
+                'market_trend': self._describe_market_trend(change, advances, declines),
+                'fetched_at': datetime.now(ZoneInfo('Asia/Kolkata')).strftime('%I:%M %p IST')
+            }
+
+            self._save_market_cache(market_data)
+            print(f"✅ Market context: Nifty {market_data['nifty_level']} ({market_data['nifty_change']}), VIX {market_data['vix']}")
+            return market_data
+
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Market context network error: {str(e)}")
+            return self._get_unavailable_market_data('source unreachable')
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            print(f"❌ Market context parsing error: {str(e)}")
+            return self._get_unavailable_market_data('unexpected response')
+        finally:
+            session.close()
+
     def analyze_stocks(self, stocks, strategy_type):
         """Analyze and rank stocks based on strategy"""
         if not stocks:
@@ -312,17 +490,25 @@ class MultiArchetypeTradingScanner:
             print(f"❌ Error analyzing stocks: {str(e)}")
             return stocks[:12]
     
-    def create_html_email(self, results):
+    def create_html_email(self, results, market_data=None):
         """Create professional HTML email"""
         current_time = datetime.now()
         
         # Market context
-        market_data = {
-            'nifty_level': '25,327',
-            'nifty_change': '+0.86%',
-            'market_trend': 'Positive bias continues with mixed sector rotation',
-            'vix': '12.45'
-        }
+        if market_data is None:
+            market_data = self.fetch_market_context()
+        
+        if not market_data['available']:
+            change_class = ''
+        elif market_data['nifty_change'].startswith('-'):
+            change_class = 'negative'
+        else:
+            change_class = 'positive'
+        
+        if market_data['available']:
+            market_source = f"Source: NSE • As of {market_data['fetched_at']}"
+        else:
+            market_source = 'Source: NSE • Live data unavailable for this report'
         
         html = f'''<!DOCTYPE html>
 <html>
@@ -496,15 +682,20 @@ class MultiArchetypeTradingScanner:
                     <div class="stat-label">Nifty 50</div>
                 </div>
                 <div class="stat">
-                    <div class="stat-value positive">{market_data['nifty_change']}</div>
+                    <div class="stat-value {change_class}">{market_data['nifty_change']}</div>
                     <div class="stat-label">Change</div>
                 </div>
+                <div class="stat">
+                    <div class="stat-value">{market_data['breadth']}</div>
+                    <div class="stat-label">Nifty 50 Adv / Dec</div>
+                </div>
                 <div class="stat">
                     <div class="stat-value">{market_data['vix']}</div>
                     <div class="stat-label">VIX</div>
                 </div>
             </div>
             <p><strong>Market Trend:</strong> {market_data['market_trend']}</p>
+            <p style="margin: 0; font-size: 11px; color: #718096;">{market_source}</p>
         </div>'''
         
         # Add strategy results
@@ -612,6 +803,10 @@ class MultiArchetypeTradingScanner:
         results = {}
         total_opportunities = 0
         
+        # Fetch market context in the background while strategies run
+        executor = ThreadPoolExecutor(max_workers=1)
+        market_future = executor.submit(self.fetch_market_context)
+        
         # Execute all strategies
         for strategy_key, strategy_info in self.strategies.items():
             print(f"\n🔍 Running: {strategy_info['name']}")
@@ -650,10 +845,19 @@ class MultiArchetypeTradingScanner:
         print(f"   Strategies executed: {len(self.strategies)}")
         print(f"   Email recipient: {self.email_to}")
         
+        # Collect market context (normally finished long before the scans)
+        try:
+            market_data = market_future.result(timeout=30)
+        except Exception as e:
+            print(f"❌ Market context error: {str(e)}")
+            market_data = self._get_unavailable_market_data('fetch failed')
+        finally:
+            executor.shutdown(wait=False)
+        
         # Generate and send email
         print(f"\n📧 Generating email report...")
         try:
-            html_content = self.create_html_email(results)
+            html_content = self.create_html_email(results, market_data)
             
             if self.send_email(html_content):
                 print("🎯 Daily scan completed successfully!")